@@ -1,20 +1,47 @@
 import os
+import re
 import secrets
 import uuid
 import json
-import base64
+import logging
+import hashlib
 import io
 import smtplib
+import sqlite3
+import shutil
+import tempfile
+import time
+import random
+from collections import Counter
+from itertools import groupby
+from operator import attrgetter
+import atexit
+import threading
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file, send_from_directory
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file, send_from_directory, abort, make_response, g, has_request_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from werkzeug.utils import secure_filename
-from PIL import Image
+from flask_caching import Cache
+from jinja2 import TemplateError
+from werkzeug.security import safe_join, generate_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import select, func, case, insert, update, bindparam, or_, union_all, event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload, selectinload, contains_eager, defer, load_only
+from PIL import Image, ImageOps, UnidentifiedImageError
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+logger = logging.getLogger(__name__)
 
 # Create Flask app
 app = Flask(__name__)
@@ -23,31 +50,209 @@ app = Flask(__name__)
 from config import Config
 app.config.from_object(Config)
 
+app.config['ALLOWED_EXTENSIONS'] = frozenset(ext.lower() for ext in app.config['ALLOWED_EXTENSIONS'])
+
 # Force PostgreSQL URL format for Render
 if os.environ.get('RENDER'):
     database_url = app.config['SQLALCHEMY_DATABASE_URI']
     if database_url and database_url.startswith('postgres://'):
         app.config['SQLALCHEMY_DATABASE_URI'] = database_url.replace('postgres://', 'postgresql://', 1)
-
-# Initialize extensions
-db = SQLAlchemy(app)
+    # Render's proxy terminates TLS; without this every client shares the proxy's address
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1)
+
+# Initialize extensions - models.py owns the SQLAlchemy instance
+from models import db
+db.init_app(app)
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside a writer; NORMAL sync is still crash-safe in WAL mode
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA cache_size=-64000')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA mmap_size=268435456')
+        cursor.close()
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+cache = Cache(app)
 
 # Import models AFTER db is initialized
-from models import User, InventoryItem, Customer, Sale, SaleItem, Communication, DiseaseReport, Notification, WeatherData, CommunityPost, PostComment, PostFollow, UserReview, AppRecommendation, CartItem, Order, OrderItem, PasswordResetToken, Message
+from models import User, InventoryItem, Customer, Sale, SaleItem, Communication, DiseaseReport, Notification, WeatherData, CommunityPost, PostComment, PostFollow, UserReview, AppRecommendation, CartItem, Order, OrderItem, PasswordResetToken, Message, LoginFailure
+
+# OpenWeather - current conditions change faster than the 5-day forecast
+OPENWEATHER_API_URL = 'http://api.openweathermap.org/data/2.5'
+WEATHER_CACHE_TIMEOUT = 300
+FORECAST_CACHE_TIMEOUT = 1800
+WEATHER_SESSION = requests.Session()
+WEATHER_SESSION.mount('http://', HTTPAdapter(pool_connections=20, pool_maxsize=50))
+# Current conditions and forecast are fetched side by side
+WEATHER_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+# Background work that should not hold up the response
+executor = ThreadPoolExecutor(max_workers=4)
+atexit.register(executor.shutdown, wait=False)
 
 # Configure Cohere
 cohere_api_key = app.config['COHERE_API_KEY']
+PLANT_ANALYSIS_CACHE_TIMEOUT = 30 * 86400
+CHAT_RESPONSE_CACHE_TIMEOUT = 3600
+CHAT_RATE_LIMIT = 20  # Cohere calls per user per window
+CHAT_RATE_WINDOW = 60
+COHERE_CHAT_URL = 'https://api.cohere.ai/v1/chat'
+PLANT_ANALYSIS_ERROR = "Error analyzing plant image. Please try again."
+# A report still 'analyzing' after this long lost its job (worker restart or redeploy)
+PLANT_ANALYSIS_STALE_AFTER = timedelta(minutes=5)
+
+# Plant analyses can hold a thread for minutes of Cohere retries, so they get their own pool
+ANALYSIS_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+atexit.register(ANALYSIS_EXECUTOR.shutdown, wait=False)
+
+# Shared session so Cohere calls reuse pooled keep-alive connections
+COHERE_SESSION = requests.Session()
+COHERE_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['POST']),
+        raise_on_status=False
+    )
+))
+COHERE_SESSION.headers.update({
+    'Authorization': f'Bearer {cohere_api_key}',
+    'Content-Type': 'application/json',
+})
+
+PRODUCT_LISTING_CACHE_TIMEOUT = 300
+PAGE_CACHE_TIMEOUT = 60
+# Backstop for notification writes that bypass invalidate_unread_count()
+UNREAD_COUNT_CACHE_TIMEOUT = 60
+USER_CACHE_TIMEOUT = 30
+
+LAST_LOGIN_UPDATE_INTERVAL = timedelta(minutes=15)
+
+# Password checks are deliberately slow, so cap attempts per client address
+LOGIN_RATE_LIMIT = 10
+LOGIN_RATE_WINDOW = 300
+
+DASHBOARD_ROUTES = {
+    'farmer': 'farmer_dashboard',
+    'agrovet': 'agrovet_dashboard',
+    'extension_officer': 'officer_dashboard',
+    'learning_institution': 'institution_dashboard',
+    'admin': 'admin_dashboard'
+}
+
+def user_cache_key(user_id):
+    return f"user:{user_id}"
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    """Serve the logged-in user from a short-lived cache instead of a SELECT on every request"""
+    cached = cache.get(user_cache_key(user_id))
+    if cached is not None:
+        # Attach without a round trip; changes made through current_user are still flushed
+        return db.session.merge(cached, load=False)
+    # The password hash stays out of the cache and is only loaded if something asks for it
+    user = db.session.get(User, int(user_id), options=[defer(User.password_hash)])
+    if user is not None:
+        cache.set(user_cache_key(user_id), user, timeout=USER_CACHE_TIMEOUT)
+    return user
+
+def invalidate_cached_user(user_id):
+    cache.delete(user_cache_key(user_id))
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
-
-def create_notification(user_id, title, message, notification_type='info', link=None):
+    name, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in app.config['ALLOWED_EXTENSIONS']
+
+NON_PLANT_RE = re.compile(r'not a plant|not plant|does not appear to be|non-plant', re.IGNORECASE)
+
+PLANT_IMAGE_SIZE = (1024, 1024)
+PROFILE_PICTURE_SIZE = (512, 512)
+UPLOAD_IMAGE_SIZE = (1280, 1280)
+IMAGE_SAVE_OPTIONS = {
+    'JPEG': {'optimize': True, 'quality': 85},
+    'WEBP': {'quality': 82, 'method': 6},
+}
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Uploaded files get unique names and are never rewritten in place, so browsers may keep them
+UPLOAD_CACHE_MAX_AGE = 7 * 86400
+
+def is_image(file):
+    """Sniff the upload's header without decoding it, leaving the stream rewound"""
+    try:
+        Image.open(file.stream)
+        return True
+    except UnidentifiedImageError:
+        return False
+    finally:
+        file.stream.seek(0)
+
+def save_image(source, filepath, max_size, image_format='JPEG'):
+    """Downscale an image (path or file object) and re-encode it as JPEG or WebP"""
+    img = ImageOps.exif_transpose(Image.open(source))
+    img.thumbnail(max_size, Image.LANCZOS)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.save(filepath, format=image_format, **IMAGE_SAVE_OPTIONS[image_format])
+
+def stage_upload(file):
+    """Write an upload to a temporary file so it can be processed after the response"""
+    staging_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'tmp')
+    os.makedirs(staging_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='upload_', dir=staging_dir)
+    with os.fdopen(fd, 'wb') as out:
+        shutil.copyfileobj(file.stream, out, UPLOAD_CHUNK_SIZE)
+    return tmp_path
+
+def process_uploaded_image(tmp_path, filename, folder, model, record_id):
+    """Re-encode a staged image as bounded WebP in its upload folder and store the filename on the record"""
+    with app.app_context():
+        try:
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], folder, filename)
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            save_image(tmp_path, filepath, UPLOAD_IMAGE_SIZE, 'WEBP')
+            
+            record = db.session.get(model, record_id)
+            if record is not None:
+                record.image = filename
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Error processing upload")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def process_profile_picture(tmp_path, user_id):
+    """Downscale a staged profile picture and make it the user's avatar"""
+    with app.app_context():
+        try:
+            filename = f"{user_id}_{uuid.uuid4().hex}.jpg"
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'profile_pictures', filename)
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            save_image(tmp_path, filepath, PROFILE_PICTURE_SIZE)
+            
+            user = db.session.get(User, user_id)
+            if user is not None:
+                user.profile_picture = filename
+                db.session.commit()
+                invalidate_cached_user(user_id)
+        except Exception:
+            db.session.rollback()
+            logger.exception("Error processing profile picture")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def create_notification(user_id, title, message, notification_type='info', link=None, commit=True):
+    """With commit=False the notification joins the caller's transaction; the caller commits and invalidates the unread count"""
     notification = Notification(
         user_id=user_id,
         title=title,
@@ -56,46 +261,141 @@ def create_notification(user_id, title, message, notification_type='info', link=
         link=link
     )
     db.session.add(notification)
-    db.session.commit()
+    if commit:
+        db.session.commit()
+        invalidate_unread_count(user_id)
+    return notification
+
+class SMTPPool:
+    """Keeps one logged-in SMTP connection per thread so emails skip the TLS and AUTH handshake"""
+    
+    def __init__(self, server, port, username, password):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = set()
+    
+    def _connect(self):
+        connection = smtplib.SMTP(self.server, self.port, timeout=30)
+        connection.starttls()
+        connection.login(self.username, self.password)
+        with self._lock:
+            self._connections.add(connection)
+        self._local.connection = connection
+        return connection
+    
+    def _discard(self, connection):
+        with self._lock:
+            self._connections.discard(connection)
+        self._local.connection = None
+        try:
+            connection.close()
+        except Exception:
+            pass
+    
+    def get_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            try:
+                connection.noop()
+                return connection
+            except smtplib.SMTPServerDisconnected:
+                self._discard(connection)
+        return self._connect()
+    
+    def send_message(self, msg):
+        connection = self.get_connection()
+        try:
+            connection.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self._discard(connection)
+            self._connect().send_message(msg)
+    
+    def close(self):
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for connection in connections:
+            try:
+                connection.quit()
+            except Exception:
+                pass
+
+smtp_pool = SMTPPool(
+    app.config.get('SMTP_SERVER', 'smtp.gmail.com'),
+    app.config.get('SMTP_PORT', 587),
+    app.config.get('SMTP_USERNAME'),
+    app.config.get('SMTP_PASSWORD')
+)
+atexit.register(smtp_pool.close)
 
 def send_email(to_email, subject, body):
     try:
-        smtp_server = app.config.get('SMTP_SERVER', 'smtp.gmail.com')
-        smtp_port = app.config.get('SMTP_PORT', 587)
-        smtp_username = app.config.get('SMTP_USERNAME')
-        smtp_password = app.config.get('SMTP_PASSWORD')
-        
-        if not all([smtp_server, smtp_username, smtp_password]):
+        if not all([smtp_pool.server, smtp_pool.username, smtp_pool.password]):
             return False
         
         msg = MIMEMultipart()
-        msg['From'] = smtp_username
+        msg['From'] = smtp_pool.username
         msg['To'] = to_email
         msg['Subject'] = subject
         
         msg.attach(MIMEText(body, 'html'))
         
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(smtp_username, smtp_password)
-        server.send_message(msg)
-        server.quit()
+        smtp_pool.send_message(msg)
         return True
-    except Exception as e:
-        print(f"Email error: {e}")
+    except Exception:
+        logger.exception("Email error")
         return False
 
-def detect_plant_disease(image_path, description=""):
+def _report_email_result(future):
+    if future.exception() is not None:
+        logger.error("Email error", exc_info=future.exception())
+    elif not future.result():
+        logger.warning("Email was not sent")
+
+def send_email_async(to_email, subject, body):
+    future = executor.submit(send_email, to_email, subject, body)
+    future.add_done_callback(_report_email_result)
+    return future
+
+def plant_analysis_cache_key(image_bytes, description=""):
+    return f"plant:{hashlib.sha256(image_bytes).hexdigest()}:{description}"
+
+def analyze_plant_report(report_id, image_bytes, description=""):
+    """Run the AI analysis for a disease report in the background and store the result"""
+    with app.app_context():
+        try:
+            analysis = detect_plant_disease(image_bytes, description)
+            report = db.session.get(DiseaseReport, report_id)
+            report.treatment_recommendation = analysis
+            report.is_plant = NON_PLANT_RE.search(analysis) is None
+            report.status = 'pending'
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Error in background plant analysis")
+            # Leave the report in a terminal state so disease_job_status stops reporting it as running
+            try:
+                report = db.session.get(DiseaseReport, report_id)
+                if report is not None:
+                    report.status = 'failed'
+                    report.treatment_recommendation = PLANT_ANALYSIS_ERROR
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Could not mark plant analysis as failed")
+
+def detect_plant_disease(image_bytes, description=""):
     """Detect plant disease using AI analysis"""
     try:
         if cohere_api_key and cohere_api_key != 'cohere-api-key-placeholder':
-            headers = {
-                'Authorization': f'Bearer {cohere_api_key}',
-                'Content-Type': 'application/json',
-            }
-            
-            with open(image_path, 'rb') as img_file:
-                img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
+            cache_key = plant_analysis_cache_key(image_bytes, description)
+            cached_analysis = cache.get(cache_key)
+            if cached_analysis is not None:
+                return cached_analysis
             
             chat_payload = {
                 'model': 'c4ai-aya-expanse-8b',
@@ -118,10 +418,11 @@ def detect_plant_disease(image_path, description=""):
                 'max_tokens': 1000
             }
             
-            response = requests.post('https://api.cohere.ai/v1/chat', json=chat_payload, headers=headers)
+            response = COHERE_SESSION.post(COHERE_CHAT_URL, json=chat_payload, timeout=60)
             result = response.json()
             
             if response.status_code == 200 and 'text' in result:
+                cache.set(cache_key, result['text'], timeout=PLANT_ANALYSIS_CACHE_TIMEOUT)
                 return result['text']
             else:
                 return "Unable to analyze plant health at the moment. Please try again later or consult with an agricultural officer."
@@ -152,134 +453,312 @@ def detect_plant_disease(image_path, description=""):
         
         Note: For accurate diagnosis, consult with your local extension officer."""
     
-    except Exception as e:
-        print(f"Error in plant detection: {e}")
-        return "Error analyzing plant image. Please try again."
+    except Exception:
+        logger.exception("Error in plant detection")
+        return PLANT_ANALYSIS_ERROR
+
+def skip_page_cache():
+    """Only anonymous pages without pending flash messages are safe to share between visitors"""
+    return current_user.is_authenticated or '_flashes' in session
+
+def touch_last_login(user):
+    """Record a login, but write at most once per LAST_LOGIN_UPDATE_INTERVAL"""
+    now = datetime.utcnow()
+    if not user.last_login or now - user.last_login > LAST_LOGIN_UPDATE_INTERVAL:
+        user.last_login = now
+        db.session.commit()
+        invalidate_cached_user(user.id)
+
+def role_required(*user_types, api=False):
+    """Login plus a user-type check before the view runs; 'admin' is granted by is_admin, never by user_type"""
+    def decorator(view):
+        @wraps(view)
+        @login_required
+        def wrapped(*args, **kwargs):
+            if not any(current_user.is_admin if role == 'admin' else current_user.user_type == role for role in user_types):
+                if api:
+                    return jsonify({'error': 'Access denied'}), 403
+                flash('Access denied', 'error')
+                return redirect(url_for('index'))
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
+
+def get_dashboard_endpoint(user):
+    return DASHBOARD_ROUTES.get('admin' if user.is_admin else user.user_type)
+
+def fetch_openweather(endpoint, location, timeout):
+    """Fetch an OpenWeather endpoint for a location, serving repeat requests from the cache"""
+    cache_key = f"wx:{endpoint}:{location.lower()}"
+    data = cache.get(cache_key)
+    if data is None:
+        response = WEATHER_SESSION.get(
+            f"{OPENWEATHER_API_URL}/{endpoint}",
+            params={'q': location, 'appid': app.config['OPENWEATHER_API_KEY'], 'units': 'metric'},
+            timeout=10
+        )
+        data = response.json()
+        if response.status_code == 200:
+            cache.set(cache_key, data, timeout=timeout)
+    return data
+
+def unread_count_cache_key(user_id):
+    return f"notif_unread:{user_id}"
 
 def get_unread_notification_count():
+    """Unread badge count, memoized on g for the request and cached per user across requests"""
     if not current_user.is_authenticated:
         return 0
-    return Notification.query.filter_by(user_id=current_user.id, is_read=False).count()
+    if 'unread_count' not in g:
+        key = unread_count_cache_key(current_user.id)
+        count = cache.get(key)
+        if count is None:
+            count = db.session.scalar(
+                select(func.count(Notification.id))
+                .where(Notification.user_id == current_user.id, Notification.is_read == False)
+            )
+            cache.set(key, count, timeout=UNREAD_COUNT_CACHE_TIMEOUT)
+        g.unread_count = count
+    return g.unread_count
+
+def invalidate_unread_count(user_id):
+    cache.delete(unread_count_cache_key(user_id))
+    if has_request_context() and current_user.is_authenticated and current_user.id == user_id:
+        g.pop('unread_count', None)
+
+@app.context_processor
+def inject_unread_count():
+    return {'unread_count': get_unread_notification_count()}
+
+def get_recent_unread_notifications(limit=5):
+    return db.session.scalars(
+        select(Notification)
+        .where(Notification.user_id == current_user.id, Notification.is_read == False)
+        .order_by(Notification.created_at.desc())
+        .limit(limit)
+    ).all()
+
+def inventory_version():
+    """Opaque tag that changes whenever stock or prices change, used to key listing caches"""
+    version = cache.get('inventory_version')
+    if version is None:
+        version = bump_inventory_version()
+    return version
+
+def bump_inventory_version():
+    version = uuid.uuid4().hex
+    cache.set('inventory_version', version, timeout=0)
+    return version
+
+def get_product_categories():
+    """Distinct categories of in-stock products, cached until the inventory changes"""
+    cache_key = f"products:categories:{inventory_version()}"
+    categories = cache.get(cache_key)
+    if categories is None:
+        categories = db.session.scalars(
+            select(InventoryItem.category)
+            .where(InventoryItem.quantity > 0, InventoryItem.category.isnot(None))
+            .distinct()
+            .order_by(InventoryItem.category)
+        ).all()
+        cache.set(cache_key, categories, timeout=PRODUCT_LISTING_CACHE_TIMEOUT)
+    return categories
+
+def decrement_inventory(quantities):
+    """Subtract (product_id, quantity) pairs from stock in a single executemany UPDATE; False if any line was short"""
+    inventory = InventoryItem.__table__
+    params = [{'product_id': product_id, 'sold': quantity} for product_id, quantity in quantities]
+    # The stock guard lives in the UPDATE itself, so it holds even where FOR UPDATE is a no-op (SQLite)
+    result = db.session.execute(
+        update(inventory)
+        .where(inventory.c.id == bindparam('product_id'), inventory.c.quantity >= bindparam('sold'))
+        .values(quantity=inventory.c.quantity - bindparam('sold')),
+        params
+    )
+    if not db.engine.dialect.supports_sane_multi_rowcount:
+        return True  # The row locks taken by the caller are the guarantee here
+    return result.rowcount == len(params)
+
+def escape_like(value):
+    """Escape backslash, % and _ so user input matches literally in LIKE ... ESCAPE '\\'"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def rate_limited(scope, identity, limit, window):
+    """Fixed-window counter; True once identity has made more than limit calls in the current window"""
+    key = f"{scope}_rate:{identity}:{int(time.time() // window)}"
+    cache.add(key, 0, timeout=window * 2)
+    return (cache.inc(key) or 0) > limit
+
+def chat_rate_limited(user_id):
+    return rate_limited('chat', user_id, CHAT_RATE_LIMIT, CHAT_RATE_WINDOW)
+
+def failed_login_key(email):
+    """Column values identifying this client's failures for email in the current window"""
+    return {
+        'address': request.remote_addr or '',
+        'email': (email or '').strip().lower()[:120],
+        'window_start': int(time.time() // LOGIN_RATE_WINDOW),
+    }
+
+def login_rate_limited(email):
+    """True once this address has failed LOGIN_RATE_LIMIT times for this email in the current window"""
+    key = failed_login_key(email)
+    count = db.session.scalar(select(LoginFailure.count).filter_by(**key))
+    return (count or 0) >= LOGIN_RATE_LIMIT
+
+def record_failed_login(email):
+    # Counted in the database: the default FileSystemCache has no atomic increment across workers
+    key = failed_login_key(email)
+    stmt = upsert_insert(LoginFailure).values(count=1, **key)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['address', 'email', 'window_start'],
+        set_={'count': LoginFailure.count + 1}
+    ))
+    LoginFailure.query.filter(LoginFailure.window_start < key['window_start']).delete()
+    db.session.commit()
+
+def upsert_insert(model):
+    """INSERT for the active dialect, with ON CONFLICT support"""
+    insert_stmt = pg_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    return insert_stmt(model)
+
+def get_cart_total(user_id):
+    return db.session.scalar(
+        select(func.sum(CartItem.quantity * InventoryItem.price))
+        .join(InventoryItem, CartItem.product_id == InventoryItem.id)
+        .where(CartItem.user_id == user_id)
+    ) or 0
 
 # ========== DATABASE INITIALIZATION ==========
-with app.app_context():
+def upgrade_schema():
+    """Bring tables created by older releases up to the current models; create_all() never alters them"""
+    inspector = inspect(db.engine)
+    inventory_columns = {column['name'] for column in inspector.get_columns('inventory_items')}
+    if 'image' not in inventory_columns:
+        db.session.execute(text('ALTER TABLE inventory_items ADD COLUMN image VARCHAR(200)'))
+
+    # add_to_cart's ON CONFLICT (user_id, product_id) needs a unique index on exactly those columns
+    cart_unique = [c['column_names'] for c in inspector.get_unique_constraints('cart_items')]
+    cart_unique += [i['column_names'] for i in inspector.get_indexes('cart_items') if i['unique']]
+    if ['user_id', 'product_id'] not in cart_unique:
+        # Fold duplicate lines into the oldest one before the index can be built
+        db.session.execute(text(
+            'UPDATE cart_items SET quantity = ('
+            ' SELECT SUM(dup.quantity) FROM cart_items dup'
+            ' WHERE dup.user_id = cart_items.user_id AND dup.product_id = cart_items.product_id)'
+            ' WHERE id IN (SELECT MIN(id) FROM cart_items GROUP BY user_id, product_id HAVING COUNT(*) > 1)'
+        ))
+        db.session.execute(text(
+            'DELETE FROM cart_items WHERE id NOT IN (SELECT MIN(id) FROM cart_items GROUP BY user_id, product_id)'
+        ))
+        db.session.execute(text(
+            'CREATE UNIQUE INDEX IF NOT EXISTS unique_cart_product ON cart_items (user_id, product_id)'
+        ))
+
+    # create_all() skips indexes on tables that already exist, so add any the models gained since
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    connection = db.session.connection()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    db.session.commit()
+
+def seed_database():
+    """Create tables, upgrade older ones and add the default admin and demo accounts"""
     db.create_all()
-    
-    # Create admin user if not exists
-    if not User.query.filter_by(email='admin@adiseware.com').first():
-        admin = User(
-            email='admin@adiseware.com',
-            full_name='System Administrator',
-            user_type='admin',
-            phone_number='+254713593573',
-            location='Nairobi',
-            is_admin=True,
-            is_verified=True
-        )
-        admin.set_password('Admin@123')
-        db.session.add(admin)
-    
-    # Create your admin user
-    if not User.query.filter_by(email='beneicto431@gmail.com').first():
-        user_admin = User(
-            email='beneicto431@gmail.com',
-            full_name='Benedict Admin',
-            user_type='admin',
-            phone_number='+254713593573',
-            location='Nairobi',
-            is_admin=True,
-            is_verified=True,
-            profile_picture='admin.jpg'
-        )
-        user_admin.set_password('12345678')
-        db.session.add(user_admin)
-    
-    # Create test farmer
-    if not User.query.filter_by(email='farmer@test.com').first():
-        farmer = User(
-            email='farmer@test.com',
-            full_name='Test Farmer',
-            user_type='farmer',
-            phone_number='+254700000001',
-            location='Nairobi'
-        )
-        farmer.set_password('password123')
-        db.session.add(farmer)
-    
-    # Create test agrovet
-    if not User.query.filter_by(email='agrovet@test.com').first():
-        agrovet = User(
-            email='agrovet@test.com',
-            full_name='Test Agrovet',
-            user_type='agrovet',
-            phone_number='+254700000002',
-            location='Nairobi'
-        )
-        agrovet.set_password('password123')
-        db.session.add(agrovet)
-    
+    upgrade_schema()
+    
+    accounts = [
+        # Admin user
+        dict(email='admin@adiseware.com', full_name='System Administrator', user_type='admin',
+             phone_number='+254713593573', location='Nairobi', is_admin=True, is_verified=True,
+             password='Admin@123'),
+        # Your admin user
+        dict(email='beneicto431@gmail.com', full_name='Benedict Admin', user_type='admin',
+             phone_number='+254713593573', location='Nairobi', is_admin=True, is_verified=True,
+             profile_picture='admin.jpg', password='12345678'),
+        # Test farmer
+        dict(email='farmer@test.com', full_name='Test Farmer', user_type='farmer',
+             phone_number='+254700000001', location='Nairobi', password='password123'),
+        # Test agrovet
+        dict(email='agrovet@test.com', full_name='Test Agrovet', user_type='agrovet',
+             phone_number='+254700000002', location='Nairobi', password='password123'),
+    ]
+    rows = []
+    for account in accounts:
+        row = {'is_admin': False, 'is_verified': False, 'profile_picture': None, **account}
+        row['password_hash'] = generate_password_hash(row.pop('password'))
+        rows.append(row)
+    
+    # One atomic statement; accounts that already exist are left untouched
+    db.session.execute(
+        upsert_insert(User).values(rows).on_conflict_do_nothing(index_elements=['email'])
+    )
     db.session.commit()
 
+@app.cli.command('seed-db')
+def seed_db_command():
+    """Create tables and seed the default accounts (run once per deploy)."""
+    if os.environ.get('SKIP_DB_SEED', 'False').lower() == 'true':
+        print('SKIP_DB_SEED is set, skipping database initialization.')
+        return
+    seed_database()
+    print('Database initialized.')
+
 # ========== BASIC PAGES ==========
 
 @app.route('/')
+@cache.cached(timeout=PAGE_CACHE_TIMEOUT, unless=skip_page_cache)
 def index():
     if current_user.is_authenticated:
-        current_user.last_login = datetime.utcnow()
-        db.session.commit()
+        touch_last_login(current_user)
         
-        if current_user.user_type == 'farmer':
-            return redirect(url_for('farmer_dashboard'))
-        elif current_user.user_type == 'agrovet':
-            return redirect(url_for('agrovet_dashboard'))
-        elif current_user.user_type == 'extension_officer':
-            return redirect(url_for('officer_dashboard'))
-        elif current_user.user_type == 'learning_institution':
-            return redirect(url_for('institution_dashboard'))
-        elif current_user.user_type == 'admin' or current_user.is_admin:
-            return redirect(url_for('admin_dashboard'))
+        endpoint = get_dashboard_endpoint(current_user)
+        if endpoint:
+            return redirect(url_for(endpoint))
     
-    return render_template('index.html', unread_count=0)
+    return render_template('index.html')
 
 @app.route('/about')
+@cache.cached(timeout=PAGE_CACHE_TIMEOUT, unless=skip_page_cache)
 def about():
-    unread_count = get_unread_notification_count() if current_user.is_authenticated else 0
-    return render_template('about.html', unread_count=unread_count)
+    return render_template('about.html')
 
 @app.route('/features')
+@cache.cached(timeout=PAGE_CACHE_TIMEOUT, unless=skip_page_cache)
 def features():
-    unread_count = get_unread_notification_count() if current_user.is_authenticated else 0
-    return render_template('features.html', unread_count=unread_count)
+    return render_template('features.html')
 
 @app.route('/contact')
+@cache.cached(timeout=PAGE_CACHE_TIMEOUT, unless=skip_page_cache)
 def contact():
-    unread_count = get_unread_notification_count() if current_user.is_authenticated else 0
-    return render_template('contact.html', unread_count=unread_count)
+    return render_template('contact.html')
 
 @app.route('/faq')
+@cache.cached(timeout=PAGE_CACHE_TIMEOUT, unless=skip_page_cache)
 def faq():
-    unread_count = get_unread_notification_count() if current_user.is_authenticated else 0
-    return render_template('faq.html', unread_count=unread_count)
+    return render_template('faq.html')
 
 @app.route('/privacy')
+@cache.cached(timeout=PAGE_CACHE_TIMEOUT, unless=skip_page_cache)
 def privacy():
-    unread_count = get_unread_notification_count() if current_user.is_authenticated else 0
-    return render_template('privacy.html', unread_count=unread_count)
+    return render_template('privacy.html')
 
 @app.route('/terms')
+@cache.cached(timeout=PAGE_CACHE_TIMEOUT, unless=skip_page_cache)
 def terms():
-    unread_count = get_unread_notification_count() if current_user.is_authenticated else 0
-    return render_template('terms.html', unread_count=unread_count)
+    return render_template('terms.html')
 
 @app.route('/pricing')
+@cache.cached(timeout=PAGE_CACHE_TIMEOUT, unless=skip_page_cache)
 def pricing():
-    unread_count = get_unread_notification_count() if current_user.is_authenticated else 0
-    return render_template('pricing.html', unread_count=unread_count)
+    return render_template('pricing.html')
 
 @app.route('/help')
+@cache.cached(timeout=PAGE_CACHE_TIMEOUT, unless=skip_page_cache)
 def help():
-    unread_count = get_unread_notification_count() if current_user.is_authenticated else 0
-    return render_template('help.html', unread_count=unread_count)
+    return render_template('help.html')
 
 # ========== AUTHENTICATION ROUTES ==========
 
@@ -298,10 +777,6 @@ def register():
             flash('Passwords do not match', 'error')
             return redirect(url_for('register'))
         
-        if User.query.filter_by(email=email).first():
-            flash('Email already registered', 'error')
-            return redirect(url_for('register'))
-        
         user = User(
             email=email,
             full_name=full_name,
@@ -311,22 +786,33 @@ def register():
         )
         user.set_password(password)
         
+        staged_picture = None
         if 'profile_picture' in request.files:
             file = request.files['profile_picture']
             if file and allowed_file(file.filename):
-                filename = secure_filename(f"{user.id}_{file.filename}")
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'profile_pictures', filename)
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                file.save(filepath)
-                user.profile_picture = filename
+                if is_image(file):
+                    staged_picture = stage_upload(file)
+                else:
+                    flash('Profile picture must be an image; you can add one later from your profile', 'warning')
         
+        # The unique email constraint is the duplicate check, so a new account is one INSERT and one commit
         db.session.add(user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            if staged_picture:
+                os.remove(staged_picture)
+            flash('Email already registered', 'error')
+            return redirect(url_for('register'))
+        
+        if staged_picture:
+            executor.submit(process_profile_picture, staged_picture, user.id)
         
         flash('Registration successful! Please login.', 'success')
         return redirect(url_for('login'))
     
-    return render_template('auth/register.html', unread_count=0)
+    return render_template('auth/register.html')
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -335,6 +821,10 @@ def login():
         password = request.form.get('password')
         remember = request.form.get('remember')
         
+        if login_rate_limited(email):
+            flash('Too many login attempts. Please wait a few minutes and try again.', 'error')
+            return render_template('auth/login.html'), 429
+        
         user = User.query.filter_by(email=email).first()
         
         if user and user.check_password(password):
@@ -343,27 +833,16 @@ def login():
                 return redirect(url_for('login'))
             
             login_user(user, remember=bool(remember))
-            user.last_login = datetime.utcnow()
-            db.session.commit()
+            touch_last_login(user)
             
             flash('Login successful!', 'success')
             
-            if user.user_type == 'farmer':
-                return redirect(url_for('farmer_dashboard'))
-            elif user.user_type == 'agrovet':
-                return redirect(url_for('agrovet_dashboard'))
-            elif user.user_type == 'extension_officer':
-                return redirect(url_for('officer_dashboard'))
-            elif user.user_type == 'learning_institution':
-                return redirect(url_for('institution_dashboard'))
-            elif user.is_admin:
-                return redirect(url_for('admin_dashboard'))
-            else:
-                return redirect(url_for('index'))
+            return redirect(url_for(get_dashboard_endpoint(user) or 'index'))
         else:
+            record_failed_login(email)
             flash('Invalid email or password', 'error')
     
-    return render_template('auth/login.html', unread_count=0)
+    return render_template('auth/login.html')
 
 @app.route('/forgot-password', methods=['GET', 'POST'])
 def forgot_password():
@@ -382,18 +861,17 @@ def forgot_password():
             db.session.commit()
             
             reset_link = url_for('reset_password', token=token, _external=True)
-            send_email(user.email, "Password Reset", f"Click to reset: {reset_link}")
+            send_email_async(user.email, "Password Reset", f"Click to reset: {reset_link}")
             
             flash('Password reset instructions sent to your email', 'success')
         else:
             flash('Email not found', 'error')
     
-    unread_count = get_unread_notification_count() if current_user.is_authenticated else 0
-    return render_template('auth/forgot_password.html', unread_count=unread_count)
+    return render_template('auth/forgot_password.html')
 
 @app.route('/reset-password/<token>', methods=['GET', 'POST'])
 def reset_password(token):
-    reset_token = PasswordResetToken.query.filter_by(token=token, used=False).first()
+    reset_token = PasswordResetToken.query.options(joinedload(PasswordResetToken.user)).filter_by(token=token, used=False).first()
     
     if not reset_token or reset_token.expires_at < datetime.utcnow():
         flash('Invalid or expired reset token', 'error')
@@ -407,16 +885,14 @@ def reset_password(token):
             flash('Passwords do not match', 'error')
             return redirect(url_for('reset_password', token=token))
         
-        user = User.query.get(reset_token.user_id)
-        user.set_password(password)
+        reset_token.user.set_password(password)
         reset_token.used = True
         db.session.commit()
         
         flash('Password reset successful! Please login.', 'success')
         return redirect(url_for('login'))
     
-    unread_count = get_unread_notification_count() if current_user.is_authenticated else 0
-    return render_template('auth/reset_password.html', token=token, unread_count=unread_count)
+    return render_template('auth/reset_password.html', token=token)
 
 @app.route('/logout')
 @login_required
@@ -430,15 +906,26 @@ def logout():
 @app.route('/profile')
 @login_required
 def profile():
-    reviews = UserReview.query.filter_by(user_id=current_user.id, is_approved=True).all()
+    reviews = UserReview.query.options(joinedload(UserReview.reviewer)).filter_by(user_id=current_user.id, is_approved=True).all()
     recent_posts = CommunityPost.query.filter_by(author_id=current_user.id).order_by(CommunityPost.created_at.desc()).limit(5).all()
-    unread_count = get_unread_notification_count()
     
-    return render_template('profile.html', reviews=reviews, recent_posts=recent_posts, unread_count=unread_count)
+    return render_template('profile.html', reviews=reviews, recent_posts=recent_posts)
 
 @app.route('/uploads/<path:filename>')
 def serve_upload(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    accel_prefix = app.config.get('UPLOADS_ACCEL_REDIRECT_PREFIX')
+    if accel_prefix:
+        # Let the reverse proxy stream the file instead of a worker
+        if safe_join(app.config['UPLOAD_FOLDER'], filename) is None:
+            abort(404)
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + filename
+        response.cache_control.public = True
+        response.cache_control.max_age = UPLOAD_CACHE_MAX_AGE
+        return response
+    response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=UPLOAD_CACHE_MAX_AGE)
+    response.cache_control.public = True
+    return response
 
 @app.route('/profile/edit', methods=['GET', 'POST'])
 @login_required
@@ -448,21 +935,24 @@ def edit_profile():
         current_user.phone_number = request.form.get('phone_number')
         current_user.location = request.form.get('location')
         
+        staged_picture = None
         if 'profile_picture' in request.files:
             file = request.files['profile_picture']
             if file and allowed_file(file.filename):
-                filename = secure_filename(f"{current_user.id}_{datetime.utcnow().timestamp()}_{file.filename}")
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'profile_pictures', filename)
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                file.save(filepath)
-                current_user.profile_picture = filename
+                if not is_image(file):
+                    flash('Profile picture must be an image', 'error')
+                    return redirect(url_for('edit_profile'))
+                staged_picture = stage_upload(file)
         
         db.session.commit()
+        invalidate_cached_user(current_user.id)
+        
+        if staged_picture:
+            executor.submit(process_profile_picture, staged_picture, current_user.id)
         flash('Profile updated successfully!', 'success')
         return redirect(url_for('profile'))
     
-    unread_count = get_unread_notification_count()
-    return render_template('edit_profile.html', unread_count=unread_count)
+    return render_template('edit_profile.html')
 
 @app.route('/change-password', methods=['POST'])
 @login_required
@@ -488,42 +978,42 @@ def change_password():
 # ========== DASHBOARD ROUTES ==========
 
 @app.route('/farmer/dashboard')
-@login_required
+@role_required('farmer')
 def farmer_dashboard():
-    if current_user.user_type != 'farmer':
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
-    
-    notifications = Notification.query.filter_by(user_id=current_user.id, is_read=False).order_by(Notification.created_at.desc()).limit(5).all()
+    notifications = get_recent_unread_notifications()
     disease_reports = DiseaseReport.query.filter_by(farmer_id=current_user.id).order_by(DiseaseReport.created_at.desc()).limit(10).all()
     recent_posts = CommunityPost.query.order_by(CommunityPost.created_at.desc()).limit(5).all()
-    unread_count = get_unread_notification_count()
     
     return render_template('farmer/dashboard.html', 
                          notifications=notifications, 
                          disease_reports=disease_reports,
-                         recent_posts=recent_posts,
-                         unread_count=unread_count)
+                         recent_posts=recent_posts)
 
 @app.route('/agrovet/dashboard')
-@login_required
+@role_required('agrovet')
 def agrovet_dashboard():
-    if current_user.user_type != 'agrovet':
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
-    
-    total_products = InventoryItem.query.filter_by(agrovet_id=current_user.id).count()
-    low_stock_items = InventoryItem.query.filter_by(agrovet_id=current_user.id).filter(InventoryItem.quantity <= InventoryItem.reorder_level).count()
-    total_customers = Customer.query.filter_by(agrovet_id=current_user.id).count()
-    
-    today = datetime.utcnow().date()
-    today_sales = Sale.query.filter_by(agrovet_id=current_user.id).filter(db.func.date(Sale.sale_date) == today).all()
-    today_revenue = sum(sale.total_amount for sale in today_sales)
+    total_products, low_stock_items, total_customers = db.session.execute(
+        select(
+            func.count(InventoryItem.id),
+            func.count(case((InventoryItem.quantity <= InventoryItem.reorder_level, 1))),
+            select(func.count(Customer.id)).where(Customer.agrovet_id == current_user.id).scalar_subquery()
+        ).where(InventoryItem.agrovet_id == current_user.id)
+    ).one()
+    
+    # Half-open range on sale_date instead of DATE(sale_date) so an index on the column stays usable
+    today_start = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    today_revenue = db.session.scalar(
+        select(func.coalesce(func.sum(Sale.total_amount), 0))
+        .where(
+            Sale.agrovet_id == current_user.id,
+            Sale.sale_date >= today_start,
+            Sale.sale_date < today_start + timedelta(days=1)
+        )
+    )
     
-    recent_sales = Sale.query.filter_by(agrovet_id=current_user.id).order_by(Sale.sale_date.desc()).limit(10).all()
-    notifications = Notification.query.filter_by(user_id=current_user.id, is_read=False).order_by(Notification.created_at.desc()).limit(5).all()
-    recent_orders = Order.query.filter_by(agrovet_id=current_user.id).order_by(Order.created_at.desc()).limit(5).all()
-    unread_count = get_unread_notification_count()
+    recent_sales = Sale.query.options(joinedload(Sale.customer)).filter_by(agrovet_id=current_user.id).order_by(Sale.sale_date.desc()).limit(10).all()
+    notifications = get_recent_unread_notifications()
+    recent_orders = Order.query.options(joinedload(Order.farmer)).filter_by(agrovet_id=current_user.id).order_by(Order.created_at.desc()).limit(5).all()
     
     return render_template('agrovet/dashboard.html', 
                          total_products=total_products,
@@ -532,107 +1022,105 @@ def agrovet_dashboard():
                          today_revenue=today_revenue,
                          recent_sales=recent_sales,
                          recent_orders=recent_orders,
-                         notifications=notifications,
-                         unread_count=unread_count)
+                         notifications=notifications)
 
 @app.route('/officer/dashboard')
-@login_required
+@role_required('extension_officer')
 def officer_dashboard():
-    if current_user.user_type != 'extension_officer':
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
-    
-    all_disease_reports = DiseaseReport.query.order_by(DiseaseReport.created_at.desc()).limit(50).all()
-    farmers = User.query.filter_by(user_type='farmer').all()
+    all_disease_reports = DiseaseReport.query.options(joinedload(DiseaseReport.farmer)).order_by(DiseaseReport.created_at.desc()).limit(50).all()
+    farmer_count = db.session.scalar(select(func.count(User.id)).where(User.user_type == 'farmer'))
     recent_posts = CommunityPost.query.order_by(CommunityPost.created_at.desc()).limit(10).all()
-    unread_count = get_unread_notification_count()
     
     return render_template('officer/dashboard.html', 
                          disease_reports=all_disease_reports, 
-                         farmers=farmers,
-                         recent_posts=recent_posts,
-                         unread_count=unread_count)
+                         farmer_count=farmer_count,
+                         recent_posts=recent_posts)
 
 @app.route('/institution/dashboard')
-@login_required
+@role_required('learning_institution')
 def institution_dashboard():
-    if current_user.user_type != 'learning_institution':
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
-    
     recent_posts = CommunityPost.query.order_by(CommunityPost.created_at.desc()).limit(10).all()
-    unread_count = get_unread_notification_count()
     
     return render_template('institution/dashboard.html', 
-                         recent_posts=recent_posts,
-                         unread_count=unread_count)
+                         recent_posts=recent_posts)
 
 @app.route('/admin/dashboard')
-@login_required
+@role_required('admin')
 def admin_dashboard():
-    if not current_user.is_admin:
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
+    # Every headline number in one round trip; the other tables are counted in scalar subqueries
+    total_users, active_users, total_posts, total_orders, total_revenue = db.session.execute(
+        select(
+            func.count(User.id),
+            func.count(case((User.is_active == True, 1))),
+            select(func.count(CommunityPost.id)).scalar_subquery(),
+            select(func.count(Order.id)).scalar_subquery(),
+            select(func.coalesce(func.sum(Order.total_amount), 0)).scalar_subquery()
+        )
+    ).one()
     
     stats = {
-        'total_users': User.query.count(),
-        'active_users': User.query.filter_by(is_active=True).count(),
-        'total_posts': CommunityPost.query.count(),
-        'total_orders': Order.query.count(),
-        'total_revenue': db.session.query(db.func.sum(Order.total_amount)).scalar() or 0,
+        'total_users': total_users,
+        'active_users': active_users,
+        'total_posts': total_posts,
+        'total_orders': total_orders,
+        'total_revenue': total_revenue,
         'recent_logins': User.query.filter(User.last_login.isnot(None)).order_by(User.last_login.desc()).limit(10).all()
     }
     
-    unread_count = get_unread_notification_count()
-    return render_template('admin/dashboard.html', stats=stats, unread_count=unread_count)
+    return render_template('admin/dashboard.html', stats=stats)
 
 @app.route('/admin/users')
-@login_required
+@role_required('admin')
 def admin_users():
-    if not current_user.is_admin:
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
-    
-    users = User.query.order_by(User.created_at.desc()).all()
-    unread_count = get_unread_notification_count()
-    return render_template('admin/users.html', users=users, unread_count=unread_count)
+    page = request.args.get('page', 1, type=int)
+    search = request.args.get('search', '').strip()
+    
+    query = User.query.options(defer(User.password_hash))
+    if search:
+        # Bind the pattern so every search reuses one compiled statement
+        query = query.filter(or_(
+            User.full_name.ilike(bindparam('pattern'), escape='\\'),
+            User.email.ilike(bindparam('pattern'), escape='\\')
+        )).params(pattern=f'%{escape_like(search)}%')
+    users = query.order_by(User.created_at.desc()).paginate(
+        page=page, per_page=50, error_out=False
+    )
+    return render_template('admin/users.html', users=users, search=search)
 
 @app.route('/admin/user/<int:user_id>/toggle', methods=['POST'])
-@login_required
+@role_required('admin', api=True)
 def toggle_user_status(user_id):
-    if not current_user.is_admin:
-        return jsonify({'error': 'Access denied'}), 403
-    
     user = User.query.get_or_404(user_id)
     user.is_active = not user.is_active
     db.session.commit()
+    invalidate_cached_user(user.id)
     
     return jsonify({'success': True, 'is_active': user.is_active})
 
 @app.route('/admin/user/<int:user_id>/reset-password', methods=['POST'])
-@login_required
+@role_required('admin', api=True)
 def admin_reset_password(user_id):
-    if not current_user.is_admin:
-        return jsonify({'error': 'Access denied'}), 403
-    
     user = User.query.get_or_404(user_id)
     new_password = request.form.get('new_password')
     
+    if not new_password:
+        flash('New password is required', 'error')
+        return redirect(url_for('admin_users'))
+    
     user.set_password(new_password)
     db.session.commit()
+    invalidate_cached_user(user.id)
     
     flash(f'Password reset for {user.email}', 'success')
     return redirect(url_for('admin_users'))
 
 @app.route('/admin/user/<int:user_id>/make-admin', methods=['POST'])
-@login_required
+@role_required('admin', api=True)
 def make_admin(user_id):
-    if not current_user.is_admin:
-        return jsonify({'error': 'Access denied'}), 403
-    
     user = User.query.get_or_404(user_id)
     user.is_admin = True
     db.session.commit()
+    invalidate_cached_user(user.id)
     
     flash(f'{user.email} is now an admin', 'success')
     return redirect(url_for('admin_users'))
@@ -640,12 +1128,8 @@ def make_admin(user_id):
 # ========== PLANT DISEASE DETECTION ==========
 
 @app.route('/farmer/detect-disease', methods=['GET', 'POST'])
-@login_required
+@role_required('farmer')
 def detect_disease():
-    if current_user.user_type != 'farmer':
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
-    
     if request.method == 'POST':
         if 'plant_image' not in request.files:
             flash('No image provided', 'error')
@@ -660,41 +1144,46 @@ def detect_disease():
         
         if file and allowed_file(file.filename):
             try:
-                filename = secure_filename(f"plant_{current_user.id}_{datetime.utcnow().timestamp()}_{file.filename}")
+                filename = f"plant_{current_user.id}_{uuid.uuid4().hex}.jpg"
                 filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'plant_disease', filename)
                 os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                file.save(filepath)
-                
-                # Analyze the image
-                analysis = detect_plant_disease(filepath, description)
-                
-                # Check if analysis indicates non-plant image
-                is_plant = True
-                if any(word in analysis.lower() for word in ['not a plant', 'not plant', 'does not appear to be', 'non-plant']):
-                    is_plant = False
-                    flash('The uploaded image does not appear to be a plant. Please upload a clear image of a plant.', 'warning')
+                image_bytes = file.read()
+                file.stream.seek(0)
+                save_image(file.stream, filepath, PLANT_IMAGE_SIZE)
                 
                 report = DiseaseReport(
                     farmer_id=current_user.id,
                     plant_image=filename,
                     plant_description=description,
-                    treatment_recommendation=analysis,
-                    is_plant=is_plant,
                     location=current_user.location
                 )
+                
+                # Reuse a cached analysis, otherwise analyze in the background
+                analysis = cache.get(plant_analysis_cache_key(image_bytes, description))
+                if analysis is not None:
+                    report.treatment_recommendation = analysis
+                    report.is_plant = NON_PLANT_RE.search(analysis) is None
+                    if report.is_plant:
+                        flash('Plant analysis completed successfully!', 'success')
+                    else:
+                        flash('The uploaded image does not appear to be a plant. Please upload a clear image of a plant.', 'warning')
+                else:
+                    report.status = 'analyzing'
+                
                 db.session.add(report)
                 db.session.commit()
                 
-                if is_plant:
-                    flash('Plant analysis completed successfully!', 'success')
+                if analysis is None:
+                    ANALYSIS_EXECUTOR.submit(analyze_plant_report, report.id, image_bytes, description)
                 
-                unread_count = get_unread_notification_count()
                 return render_template('farmer/disease_result.html', 
                                      report=report, 
                                      analysis=analysis,
-                                     image_url=url_for('serve_upload', filename=f'plant_disease/{filename}'),
-                                     unread_count=unread_count)
+                                     image_url=url_for('serve_upload', filename=f'plant_disease/{filename}'))
                 
+            except UnidentifiedImageError:
+                flash('The uploaded file is not a valid image', 'error')
+                return redirect(url_for('detect_disease'))
             except Exception as e:
                 flash(f'Error processing image: {str(e)}', 'error')
                 return redirect(url_for('detect_disease'))
@@ -702,19 +1191,36 @@ def detect_disease():
         else:
             flash('Invalid file type. Please upload an image (PNG, JPG, JPEG)', 'error')
     
-    unread_count = get_unread_notification_count()
-    return render_template('farmer/detect_disease.html', unread_count=unread_count)
+    return render_template('farmer/detect_disease.html')
 
-@app.route('/farmer/disease-history')
+@app.route('/farmer/disease-job/<int:report_id>')
 @login_required
-def disease_history():
-    if current_user.user_type != 'farmer':
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
+def disease_job_status(report_id):
+    report = DiseaseReport.query.get_or_404(report_id)
     
-    reports = DiseaseReport.query.filter_by(farmer_id=current_user.id).order_by(DiseaseReport.created_at.desc()).all()
-    unread_count = get_unread_notification_count()
-    return render_template('farmer/disease_history.html', reports=reports, unread_count=unread_count)
+    if report.farmer_id != current_user.id:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    if report.status == 'analyzing' and report.created_at < datetime.utcnow() - PLANT_ANALYSIS_STALE_AFTER:
+        report.status = 'failed'
+        report.treatment_recommendation = PLANT_ANALYSIS_ERROR
+        db.session.commit()
+    
+    return jsonify({
+        'done': report.status != 'analyzing',
+        'failed': report.status == 'failed',
+        'is_plant': report.is_plant,
+        'analysis': report.treatment_recommendation
+    })
+
+@app.route('/farmer/disease-history')
+@role_required('farmer')
+def disease_history():
+    page = request.args.get('page', 1, type=int)
+    reports = DiseaseReport.query.filter_by(farmer_id=current_user.id).order_by(DiseaseReport.created_at.desc()).paginate(
+        page=page, per_page=50, error_out=False
+    )
+    return render_template('farmer/disease_history.html', reports=reports)
 
 # ========== AI CHAT ROUTES ==========
 
@@ -734,10 +1240,20 @@ def ai_chat():
         
         try:
             if cohere_api_key and cohere_api_key != 'cohere-api-key-placeholder':
-                headers = {
-                    'Authorization': f'Bearer {cohere_api_key}',
-                    'Content-Type': 'application/json',
-                }
+                normalized = ' '.join(message.lower().split())
+                cache_key = f"cohere:{hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).hexdigest()}"
+                cached_response = cache.get(cache_key)
+                if cached_response is not None:
+                    return jsonify({
+                        'success': True,
+                        'response': cached_response
+                    })
+                
+                if chat_rate_limited(current_user.id):
+                    return jsonify({
+                        'success': False,
+                        'error': 'Too many questions at once. Please wait a minute and try again.'
+                    }), 429
                 
                 chat_payload = {
                     'model': 'c4ai-aya-expanse-8b',
@@ -760,11 +1276,12 @@ Provide practical, actionable advice specific to Kenyan farming conditions.
 Be concise but thorough. If you don't know something, admit it and suggest consulting local extension officers."""
                 }
                 
-                response = requests.post('https://api.cohere.ai/v1/chat', json=chat_payload, headers=headers)
+                response = COHERE_SESSION.post(COHERE_CHAT_URL, json=chat_payload, timeout=60)
                 result = response.json()
                 
                 if response.status_code == 200 and 'text' in result:
                     ai_response = result['text']
+                    cache.set(cache_key, ai_response, timeout=CHAT_RESPONSE_CACHE_TIMEOUT)
                     return jsonify({
                         'success': True,
                         'response': ai_response
@@ -785,7 +1302,6 @@ Be concise but thorough. If you don't know something, admit it and suggest consu
                     "Regular pruning helps improve air circulation and prevent diseases."
                 ]
                 
-                import random
                 ai_response = random.choice(responses)
                 
                 return jsonify({
@@ -799,8 +1315,7 @@ Be concise but thorough. If you don't know something, admit it and suggest consu
                 'error': f'Chat service error: {str(e)}'
             })
     
-    unread_count = get_unread_notification_count()
-    return render_template('ai_chat.html', unread_count=unread_count)
+    return render_template('ai_chat.html')
 
 # ========== WEATHER ROUTE ==========
 
@@ -810,35 +1325,41 @@ def weather():
     location = request.args.get('location', current_user.location or 'Nairobi')
     
     try:
-        weather_url = f"http://api.openweathermap.org/data/2.5/weather?q={location}&appid={app.config['OPENWEATHER_API_KEY']}&units=metric"
-        response = requests.get(weather_url)
-        weather_data = response.json()
+        weather_future = WEATHER_EXECUTOR.submit(fetch_openweather, 'weather', location, WEATHER_CACHE_TIMEOUT)
+        forecast_future = WEATHER_EXECUTOR.submit(fetch_openweather, 'forecast', location, FORECAST_CACHE_TIMEOUT)
+        weather_data = weather_future.result()
+        forecast_data = forecast_future.result()
         
-        forecast_url = f"http://api.openweathermap.org/data/2.5/forecast?q={location}&appid={app.config['OPENWEATHER_API_KEY']}&units=metric"
-        forecast_response = requests.get(forecast_url)
-        forecast_data = forecast_response.json()
-        
-        unread_count = get_unread_notification_count()
-        return render_template('weather.html', weather=weather_data, forecast=forecast_data, unread_count=unread_count)
+        return render_template('weather.html', weather=weather_data, forecast=forecast_data)
     except Exception as e:
         flash(f'Error fetching weather data: {str(e)}', 'error')
-        unread_count = get_unread_notification_count()
-        return render_template('weather.html', weather=None, forecast=None, unread_count=unread_count)
+        return render_template('weather.html', weather=None, forecast=None)
 
 # ========== COMMUNITY ROUTES ==========
 
 @app.route('/community')
 @login_required
 def community():
-    page = request.args.get('page', 1, type=int)
     per_page = 20
+    query = CommunityPost.query.order_by(CommunityPost.created_at.desc(), CommunityPost.id.desc())
     
-    posts = CommunityPost.query.order_by(CommunityPost.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    # Seek past the last post of the previous page instead of using OFFSET
+    after = request.args.get('after', '')
+    if after:
+        try:
+            after_ts, after_id = after.rsplit(',', 1)
+            cursor = (datetime.fromisoformat(after_ts), int(after_id))
+        except ValueError:
+            abort(400)
+        query = query.filter(db.tuple_(CommunityPost.created_at, CommunityPost.id) < cursor)
     
-    unread_count = get_unread_notification_count()
-    return render_template('community/posts.html', posts=posts, unread_count=unread_count)
+    posts = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(posts) > per_page:
+        posts = posts[:per_page]
+        next_cursor = f"{posts[-1].created_at.isoformat()},{posts[-1].id}"
+    
+    return render_template('community/posts.html', posts=posts, next_cursor=next_cursor, is_first_page=not after)
 
 @app.route('/community/create', methods=['GET', 'POST'])
 @login_required
@@ -859,37 +1380,40 @@ def create_post():
             author_id=current_user.id
         )
         
+        staged_image = None
         if 'post_image' in request.files:
             file = request.files['post_image']
             if file and allowed_file(file.filename):
-                filename = secure_filename(f"post_{current_user.id}_{datetime.utcnow().timestamp()}_{file.filename}")
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'community_posts', filename)
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                file.save(filepath)
-                post.image = filename
+                if is_image(file):
+                    filename = f"post_{current_user.id}_{uuid.uuid4().hex}.webp"
+                    staged_image = (stage_upload(file), filename)
+                else:
+                    flash('Post image must be an image; the post was published without it', 'warning')
         
         db.session.add(post)
         db.session.commit()
         
+        if staged_image:
+            executor.submit(process_uploaded_image, *staged_image, 'community_posts', CommunityPost, post.id)
+        
         flash('Post created successfully!', 'success')
         return redirect(url_for('community'))
     
-    unread_count = get_unread_notification_count()
-    return render_template('community/create_post.html', unread_count=unread_count)
+    return render_template('community/create_post.html')
 
 @app.route('/community/post/<int:post_id>')
 @login_required
 def view_post(post_id):
     post = CommunityPost.query.get_or_404(post_id)
     comments = PostComment.query.filter_by(post_id=post_id).order_by(PostComment.created_at.asc()).all()
-    is_following = PostFollow.query.filter_by(post_id=post_id, user_id=current_user.id).first() is not None
+    is_following = db.session.query(
+        PostFollow.query.filter_by(post_id=post_id, user_id=current_user.id).exists()
+    ).scalar()
     
-    unread_count = get_unread_notification_count()
     return render_template('community/view_post.html', 
                          post=post, 
                          comments=comments,
-                         is_following=is_following,
-                         unread_count=unread_count)
+                         is_following=is_following)
 
 @app.route('/community/post/<int:post_id>/comment', methods=['POST'])
 @login_required
@@ -915,10 +1439,10 @@ def add_comment(post_id):
 @app.route('/community/post/<int:post_id>/follow', methods=['POST'])
 @login_required
 def follow_post(post_id):
-    existing_follow = PostFollow.query.filter_by(post_id=post_id, user_id=current_user.id).first()
+    # Toggle without a lookup: the DELETE's rowcount says whether a follow existed
+    unfollowed = PostFollow.query.filter_by(post_id=post_id, user_id=current_user.id).delete()
     
-    if existing_follow:
-        db.session.delete(existing_follow)
+    if unfollowed:
         message = 'Post unfollowed'
     else:
         follow = PostFollow(post_id=post_id, user_id=current_user.id)
@@ -938,23 +1462,47 @@ def follow_post(post_id):
 @app.route('/products')
 @login_required
 def browse_products():
-    products = InventoryItem.query.join(User).filter(
-        InventoryItem.quantity > 0,
-        User.user_type == 'agrovet',
-        User.is_active == True
-    ).all()
-    
-    product_groups = {}
-    for product in products:
-        if product.product_name not in product_groups:
-            product_groups[product.product_name] = []
-        product_groups[product.product_name].append(product)
-    
-    for product_name in product_groups:
-        product_groups[product_name].sort(key=lambda x: x.price)
-    
-    unread_count = get_unread_notification_count()
-    return render_template('products/browse.html', product_groups=product_groups, unread_count=unread_count)
+    # The page itself is per-user (cart badge, navbar), so cache the listing data rather than the HTML
+    cache_key = f"products:listing:{inventory_version()}"
+    product_groups = cache.get(cache_key)
+    if product_groups is None:
+        # Only the columns the listing keeps; descriptions and supplier details stay in the database
+        products = InventoryItem.query.join(InventoryItem.agrovet).options(
+            load_only(InventoryItem.id, InventoryItem.product_name, InventoryItem.price,
+                      InventoryItem.quantity, InventoryItem.unit),
+            contains_eager(InventoryItem.agrovet).load_only(User.id, User.full_name, User.location)
+        ).filter(
+            InventoryItem.quantity > 0,
+            User.user_type == 'agrovet',
+            User.is_active == True
+        ).order_by(InventoryItem.product_name, InventoryItem.price).all()
+        
+        # Rows arrive grouped by name and cheapest first
+        product_groups = {
+            product_name: [
+                {
+                    'id': product.id,
+                    'price': product.price,
+                    'quantity': product.quantity,
+                    'unit': product.unit,
+                    'agrovet': {
+                        'id': product.agrovet.id,
+                        'full_name': product.agrovet.full_name,
+                        'location': product.agrovet.location
+                    }
+                }
+                for product in group
+            ]
+            for product_name, group in groupby(products, key=attrgetter('product_name'))
+        }
+        cache.set(cache_key, product_groups, timeout=PRODUCT_LISTING_CACHE_TIMEOUT)
+    
+    response = make_response(render_template('products/browse.html', product_groups=product_groups, categories=get_product_categories()))
+    # Per-user page, so no shared caching; the browser revalidates and gets a 304 when nothing changed
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
 
 @app.route('/products/<int:product_id>')
 @login_required
@@ -965,17 +1513,17 @@ def view_product(product_id):
         flash('Product not available', 'error')
         return redirect(url_for('browse_products'))
     
-    unread_count = get_unread_notification_count()
-    return render_template('products/view_product.html', product=product, unread_count=unread_count)
+    return render_template('products/view_product.html', product=product)
 
 @app.route('/cart')
 @login_required
 def view_cart():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    total = sum(item.quantity * item.product.price for item in cart_items)
+    cart_items = CartItem.query.options(
+        joinedload(CartItem.product).joinedload(InventoryItem.agrovet)
+    ).filter_by(user_id=current_user.id).all()
+    total = get_cart_total(current_user.id)
     
-    unread_count = get_unread_notification_count()
-    return render_template('cart/view.html', cart_items=cart_items, total=total, unread_count=unread_count)
+    return render_template('cart/view.html', cart_items=cart_items, total=total)
 
 @app.route('/cart/add/<int:product_id>', methods=['POST'])
 @login_required
@@ -987,18 +1535,12 @@ def add_to_cart(product_id):
         flash(f'Only {product.quantity} items available in stock', 'error')
         return redirect(url_for('view_product', product_id=product_id))
     
-    cart_item = CartItem.query.filter_by(user_id=current_user.id, product_id=product_id).first()
-    
-    if cart_item:
-        cart_item.quantity += quantity
-    else:
-        cart_item = CartItem(
-            user_id=current_user.id,
-            product_id=product_id,
-            quantity=quantity
-        )
-        db.session.add(cart_item)
-    
+    # Add the line or top up the existing one in a single statement; concurrent clicks can't duplicate it
+    stmt = upsert_insert(CartItem).values(user_id=current_user.id, product_id=product_id, quantity=quantity)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id', 'product_id'],
+        set_={'quantity': CartItem.quantity + stmt.excluded.quantity}
+    ))
     db.session.commit()
     
     flash(f'{product.product_name} added to cart!', 'success')
@@ -1046,17 +1588,27 @@ def remove_from_cart(item_id):
 @app.route('/checkout', methods=['GET', 'POST'])
 @login_required
 def checkout():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
+    # One pass over cart lines joined to their products; on submit the
+    # product rows are locked so concurrent checkouts can't oversell.
+    query = db.session.query(CartItem, InventoryItem).join(
+        InventoryItem, CartItem.product_id == InventoryItem.id
+    ).filter(CartItem.user_id == current_user.id)
+    if request.method == 'POST':
+        query = query.with_for_update(of=InventoryItem)
+    rows = query.all()
     
-    if not cart_items:
+    if not rows:
         flash('Your cart is empty', 'error')
         return redirect(url_for('view_cart'))
     
     # Check stock availability
-    for item in cart_items:
-        if item.product.quantity < item.quantity:
-            flash(f'Insufficient stock for {item.product.product_name}. Only {item.product.quantity} available.', 'error')
-            return redirect(url_for('view_cart'))
+    short = [product for item, product in rows if product.quantity < item.quantity]
+    if short:
+        product = short[0]
+        flash(f'Insufficient stock for {product.product_name}. Only {product.quantity} available.', 'error')
+        return redirect(url_for('view_cart'))
+    
+    total = get_cart_total(current_user.id)
     
     if request.method == 'POST':
         shipping_address = request.form.get('shipping_address')
@@ -1065,76 +1617,103 @@ def checkout():
         
         # Create order
         order = Order(
-            user_id=current_user.id,
-            agrovet_id=cart_items[0].product.agrovet_id,
-            shipping_address=shipping_address,
+            farmer_id=current_user.id,
+            agrovet_id=rows[0][1].agrovet_id,
+            order_number=f"ORD-{datetime.utcnow():%Y%m%d}-{uuid.uuid4().hex[:8].upper()}",
+            delivery_address=shipping_address,
+            farmer_phone=current_user.phone_number,
             payment_method=payment_method,
             notes=notes,
-            total_amount=sum(item.quantity * item.product.price for item in cart_items)
+            total_amount=total
         )
         
         db.session.add(order)
+        db.session.flush()  # Get order ID
+        
+        # Create order items in one batched INSERT
+        db.session.execute(insert(OrderItem), [
+            {
+                'order_id': order.id,
+                'product_id': product.id,
+                'product_name': product.product_name,
+                'quantity': item.quantity,
+                'unit_price': product.price,
+                'subtotal': item.quantity * product.price
+            }
+            for item, product in rows
+        ])
         
-        # Create order items and update inventory
-        for item in cart_items:
-            order_item = OrderItem(
-                order=order,
-                product_id=item.product_id,
-                quantity=item.quantity,
-                price=item.product.price
-            )
-            db.session.add(order_item)
-            
-            # Update inventory
-            item.product.quantity -= item.quantity
+        # Update inventory
+        if not decrement_inventory((product.id, item.quantity) for item, product in rows):
+            db.session.rollback()
+            flash('Some items sold out while you were checking out. Please review your cart.', 'error')
+            return redirect(url_for('view_cart'))
         
         # Clear cart
         CartItem.query.filter_by(user_id=current_user.id).delete()
         
+        # Commits together with the order, so the agrovet is never told about an order that rolled back
+        create_notification(order.agrovet_id, 'New order received',
+                            f'Order {order.order_number} from {current_user.full_name}',
+                            'info', url_for('view_order', order_id=order.id), commit=False)
+        
         db.session.commit()
+        bump_inventory_version()
+        invalidate_unread_count(order.agrovet_id)
         
         flash('Order placed successfully!', 'success')
         return redirect(url_for('order_confirmation', order_id=order.id))
     
-    total = sum(item.quantity * item.product.price for item in cart_items)
-    unread_count = get_unread_notification_count()
+    cart_items = [item for item, _ in rows]
     
-    return render_template('cart/checkout.html', cart_items=cart_items, total=total, unread_count=unread_count)
+    return render_template('cart/checkout.html', cart_items=cart_items, total=total)
 
 @app.route('/order/confirmation/<int:order_id>')
 @login_required
 def order_confirmation(order_id):
-    order = Order.query.get_or_404(order_id)
+    order = Order.query.options(
+        selectinload(Order.items).joinedload(OrderItem.product),
+        joinedload(Order.agrovet)
+    ).filter_by(id=order_id).first_or_404()
     
-    if order.user_id != current_user.id:
+    if order.farmer_id != current_user.id:
         flash('Access denied', 'error')
         return redirect(url_for('index'))
     
-    unread_count = get_unread_notification_count()
-    return render_template('cart/confirmation.html', order=order, unread_count=unread_count)
+    return render_template('cart/confirmation.html', order=order)
 
 @app.route('/orders')
 @login_required
 def my_orders():
     if current_user.user_type == 'agrovet':
-        orders = Order.query.filter_by(agrovet_id=current_user.id).order_by(Order.created_at.desc()).all()
+        query = Order.query.filter_by(agrovet_id=current_user.id)
     else:
-        orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
+        query = Order.query.filter_by(farmer_id=current_user.id)
+    page = request.args.get('page', 1, type=int)
+    orders = query.options(
+        selectinload(Order.items).joinedload(OrderItem.product),
+        joinedload(Order.farmer),
+        joinedload(Order.agrovet)
+    ).order_by(Order.created_at.desc()).paginate(
+        page=page, per_page=20, error_out=False
+    )
     
-    unread_count = get_unread_notification_count()
-    return render_template('orders/list.html', orders=orders, unread_count=unread_count)
+    return render_template('orders/list.html', orders=orders)
 
 @app.route('/orders/<int:order_id>')
 @login_required
 def view_order(order_id):
-    order = Order.query.get_or_404(order_id)
+    order = Order.query.options(
+        selectinload(Order.items).joinedload(OrderItem.product),
+        joinedload(Order.farmer),
+        joinedload(Order.agrovet)
+    ).filter_by(id=order_id).first_or_404()
     
-    if order.user_id != current_user.id and order.agrovet_id != current_user.id:
+    if order.farmer_id != current_user.id and order.agrovet_id != current_user.id:
         flash('Access denied', 'error')
         return redirect(url_for('index'))
     
-    unread_count = get_unread_notification_count()
-    return render_template('orders/view.html', order=order, unread_count=unread_count)
+    return render_template('orders/view.html', order=order)
 
 @app.route('/orders/<int:order_id>/update-status', methods=['POST'])
 @login_required
@@ -1160,27 +1739,21 @@ def update_order_status(order_id):
 # ========== AGROVET INVENTORY ROUTES ==========
 
 @app.route('/agrovet/inventory')
-@login_required
+@role_required('agrovet')
 def agrovet_inventory():
-    if current_user.user_type != 'agrovet':
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
-    
-    inventory = InventoryItem.query.filter_by(agrovet_id=current_user.id).order_by(InventoryItem.product_name).all()
+    page = request.args.get('page', 1, type=int)
+    pagination = InventoryItem.query.filter_by(agrovet_id=current_user.id).order_by(
+        InventoryItem.product_name, InventoryItem.id
+    ).paginate(page=page, per_page=20, error_out=False)
     low_stock = InventoryItem.query.filter_by(agrovet_id=current_user.id).filter(
         InventoryItem.quantity <= InventoryItem.reorder_level
     ).all()
     
-    unread_count = get_unread_notification_count()
-    return render_template('agrovet/inventory.html', inventory=inventory, low_stock=low_stock, unread_count=unread_count)
+    return render_template('agrovet/inventory.html', inventory=pagination.items, pagination=pagination, low_stock=low_stock)
 
 @app.route('/agrovet/inventory/add', methods=['GET', 'POST'])
-@login_required
+@role_required('agrovet')
 def add_inventory_item():
-    if current_user.user_type != 'agrovet':
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
-    
     if request.method == 'POST':
         product_name = request.form.get('product_name')
         category = request.form.get('category')
@@ -1201,31 +1774,31 @@ def add_inventory_item():
             unit=unit
         )
         
+        staged_image = None
         if 'product_image' in request.files:
             file = request.files['product_image']
             if file and allowed_file(file.filename):
-                filename = secure_filename(f"product_{current_user.id}_{datetime.utcnow().timestamp()}_{file.filename}")
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'products', filename)
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                file.save(filepath)
-                item.image = filename
+                if is_image(file):
+                    filename = f"product_{current_user.id}_{uuid.uuid4().hex}.webp"
+                    staged_image = (stage_upload(file), filename)
+                else:
+                    flash('Product image must be an image; the product was saved without one', 'warning')
         
         db.session.add(item)
         db.session.commit()
+        bump_inventory_version()
+        
+        if staged_image:
+            executor.submit(process_uploaded_image, *staged_image, 'products', InventoryItem, item.id)
         
         flash('Product added to inventory!', 'success')
         return redirect(url_for('agrovet_inventory'))
     
-    unread_count = get_unread_notification_count()
-    return render_template('agrovet/add_inventory.html', unread_count=unread_count)
+    return render_template('agrovet/add_inventory.html')
 
 @app.route('/agrovet/inventory/<int:item_id>/edit', methods=['GET', 'POST'])
-@login_required
+@role_required('agrovet')
 def edit_inventory_item(item_id):
-    if current_user.user_type != 'agrovet':
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
-    
     item = InventoryItem.query.get_or_404(item_id)
     
     if item.agrovet_id != current_user.id:
@@ -1241,28 +1814,30 @@ def edit_inventory_item(item_id):
         item.reorder_level = int(request.form.get('reorder_level', 10))
         item.unit = request.form.get('unit', 'pieces')
         
+        staged_image = None
         if 'product_image' in request.files:
             file = request.files['product_image']
             if file and allowed_file(file.filename):
-                filename = secure_filename(f"product_{current_user.id}_{datetime.utcnow().timestamp()}_{file.filename}")
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'products', filename)
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                file.save(filepath)
-                item.image = filename
+                if is_image(file):
+                    filename = f"product_{current_user.id}_{uuid.uuid4().hex}.webp"
+                    staged_image = (stage_upload(file), filename)
+                else:
+                    flash('Product image must be an image; the current image was kept', 'warning')
         
         db.session.commit()
+        bump_inventory_version()
+        
+        if staged_image:
+            executor.submit(process_uploaded_image, *staged_image, 'products', InventoryItem, item.id)
+        
         flash('Product updated!', 'success')
         return redirect(url_for('agrovet_inventory'))
     
-    unread_count = get_unread_notification_count()
-    return render_template('agrovet/edit_inventory.html', item=item, unread_count=unread_count)
+    return render_template('agrovet/edit_inventory.html', item=item)
 
 @app.route('/agrovet/inventory/<int:item_id>/delete', methods=['POST'])
-@login_required
+@role_required('agrovet', api=True)
 def delete_inventory_item(item_id):
-    if current_user.user_type != 'agrovet':
-        return jsonify({'error': 'Access denied'}), 403
-    
     item = InventoryItem.query.get_or_404(item_id)
     
     if item.agrovet_id != current_user.id:
@@ -1270,29 +1845,25 @@ def delete_inventory_item(item_id):
     
     db.session.delete(item)
     db.session.commit()
+    bump_inventory_version()
     
     return jsonify({'success': True})
 
 # ========== CUSTOMER MANAGEMENT ==========
 
 @app.route('/agrovet/customers')
-@login_required
+@role_required('agrovet')
 def agrovet_customers():
-    if current_user.user_type != 'agrovet':
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
-    
-    customers = Customer.query.filter_by(agrovet_id=current_user.id).order_by(Customer.created_at.desc()).all()
+    page = request.args.get('page', 1, type=int)
+    pagination = Customer.query.filter_by(agrovet_id=current_user.id).order_by(
+        Customer.created_at.desc()
+    ).paginate(page=page, per_page=20, error_out=False)
     
-    unread_count = get_unread_notification_count()
-    return render_template('agrovet/customers.html', customers=customers, unread_count=unread_count)
+    return render_template('agrovet/customers.html', customers=pagination.items, pagination=pagination)
 
 @app.route('/agrovet/customers/add', methods=['POST'])
-@login_required
+@role_required('agrovet', api=True)
 def add_customer():
-    if current_user.user_type != 'agrovet':
-        return jsonify({'error': 'Access denied'}), 403
-    
     name = request.form.get('name')
     phone = request.form.get('phone')
     email = request.form.get('email')
@@ -1314,24 +1885,18 @@ def add_customer():
 # ========== SALES MANAGEMENT ==========
 
 @app.route('/agrovet/sales')
-@login_required
+@role_required('agrovet')
 def agrovet_sales():
-    if current_user.user_type != 'agrovet':
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
-    
-    sales = Sale.query.filter_by(agrovet_id=current_user.id).order_by(Sale.sale_date.desc()).all()
+    page = request.args.get('page', 1, type=int)
+    pagination = Sale.query.options(joinedload(Sale.customer)).filter_by(agrovet_id=current_user.id).order_by(
+        Sale.sale_date.desc()
+    ).paginate(page=page, per_page=20, error_out=False)
     
-    unread_count = get_unread_notification_count()
-    return render_template('agrovet/sales.html', sales=sales, unread_count=unread_count)
+    return render_template('agrovet/sales.html', sales=pagination.items, pagination=pagination)
 
 @app.route('/agrovet/sales/new', methods=['GET', 'POST'])
-@login_required
+@role_required('agrovet')
 def new_sale():
-    if current_user.user_type != 'agrovet':
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
-    
     if request.method == 'POST':
         customer_id = request.form.get('customer_id')
         items = json.loads(request.form.get('items', '[]'))
@@ -1340,29 +1905,38 @@ def new_sale():
             flash('No items selected for sale', 'error')
             return redirect(url_for('new_sale'))
         
+        # Load and lock every product in the sale with one query
+        product_ids = {str(item_data.get('product_id')) for item_data in items}
+        products = {
+            str(product.id): product
+            for product in InventoryItem.query.filter(
+                InventoryItem.id.in_([pid for pid in product_ids if pid.isdigit()]),
+                InventoryItem.agrovet_id == current_user.id
+            ).with_for_update()
+        }
+        
         # Check stock and calculate total
         total_amount = 0
         sale_items = []
+        sold = Counter()  # Total per product, so repeated lines are checked and decremented together
         
         for item_data in items:
             product_id = item_data.get('product_id')
             quantity = int(item_data.get('quantity', 1))
             
-            product = InventoryItem.query.get(product_id)
+            product = products.get(str(product_id))
             
-            if not product or product.agrovet_id != current_user.id:
+            if not product:
                 flash(f'Invalid product: {product_id}', 'error')
                 return redirect(url_for('new_sale'))
             
-            if product.quantity < quantity:
+            sold[product.id] += quantity
+            if product.quantity < sold[product.id]:
                 flash(f'Insufficient stock for {product.product_name}', 'error')
                 return redirect(url_for('new_sale'))
             
             total_amount += product.price * quantity
             
-            # Update inventory
-            product.quantity -= quantity
-            
             sale_items.append({
                 'product': product,
                 'quantity': quantity,
@@ -1379,17 +1953,26 @@ def new_sale():
         db.session.add(sale)
         db.session.flush()  # Get sale ID
         
-        # Create sale items
-        for item_data in sale_items:
-            sale_item = SaleItem(
-                sale_id=sale.id,
-                product_id=item_data['product'].id,
-                quantity=item_data['quantity'],
-                price=item_data['price']
-            )
-            db.session.add(sale_item)
+        # Create sale items in one batched INSERT
+        db.session.execute(insert(SaleItem), [
+            {
+                'sale_id': sale.id,
+                'product_name': item_data['product'].product_name,
+                'quantity': item_data['quantity'],
+                'unit_price': item_data['price'],
+                'subtotal': item_data['price'] * item_data['quantity']
+            }
+            for item_data in sale_items
+        ])
+        
+        # Update inventory
+        if not decrement_inventory(sold.items()):
+            db.session.rollback()
+            flash('Insufficient stock for one or more items', 'error')
+            return redirect(url_for('new_sale'))
         
         db.session.commit()
+        bump_inventory_version()
         
         flash('Sale recorded successfully!', 'success')
         return redirect(url_for('agrovet_sales'))
@@ -1397,17 +1980,18 @@ def new_sale():
     products = InventoryItem.query.filter_by(agrovet_id=current_user.id).filter(InventoryItem.quantity > 0).all()
     customers = Customer.query.filter_by(agrovet_id=current_user.id).all()
     
-    unread_count = get_unread_notification_count()
-    return render_template('agrovet/new_sale.html', products=products, customers=customers, unread_count=unread_count)
+    return render_template('agrovet/new_sale.html', products=products, customers=customers)
 
 # ========== NOTIFICATION ROUTES ==========
 
 @app.route('/notifications')
 @login_required
 def notifications():
-    notifications_list = Notification.query.filter_by(user_id=current_user.id).order_by(Notification.created_at.desc()).all()
-    unread_count = get_unread_notification_count()
-    return render_template('notifications.html', notifications=notifications_list, unread_count=unread_count)
+    page = request.args.get('page', 1, type=int)
+    pagination = Notification.query.filter_by(user_id=current_user.id).order_by(
+        Notification.created_at.desc()
+    ).paginate(page=page, per_page=20, error_out=False)
+    return render_template('notifications.html', notifications=pagination.items, pagination=pagination)
 
 @app.route('/notifications/read/<int:notification_id>', methods=['POST'])
 @login_required
@@ -1419,14 +2003,16 @@ def mark_notification_read(notification_id):
     
     notification.is_read = True
     db.session.commit()
+    invalidate_unread_count(current_user.id)
     
     return jsonify({'success': True})
 
 @app.route('/notifications/read-all', methods=['POST'])
 @login_required
 def mark_all_notifications_read():
-    Notification.query.filter_by(user_id=current_user.id, is_read=False).update({'is_read': True})
+    Notification.query.filter_by(user_id=current_user.id, is_read=False).update({'is_read': True}, synchronize_session=False)
     db.session.commit()
+    invalidate_unread_count(current_user.id)
     
     return jsonify({'success': True})
 
@@ -1435,14 +2021,25 @@ def mark_all_notifications_read():
 @app.route('/messages')
 @login_required
 def messages():
-    sent_messages = Message.query.filter_by(sender_id=current_user.id).order_by(Message.created_at.desc()).all()
-    received_messages = Message.query.filter_by(receiver_id=current_user.id).order_by(Message.created_at.desc()).all()
+    # Cap each direction separately so a busy inbox cannot crowd out the sent list
+    sent = (
+        select(Message.id).where(Message.sender_id == current_user.id)
+        .order_by(Message.created_at.desc()).limit(100).subquery()
+    )
+    received = (
+        select(Message.id).where(Message.receiver_id == current_user.id)
+        .order_by(Message.created_at.desc()).limit(100).subquery()
+    )
+    recent_ids = union_all(select(sent.c.id), select(received.c.id)).subquery()
+    recent_messages = Message.query.filter(
+        Message.id.in_(select(recent_ids.c.id))
+    ).order_by(Message.created_at.desc()).all()
+    sent_messages = [m for m in recent_messages if m.sender_id == current_user.id]
+    received_messages = [m for m in recent_messages if m.receiver_id == current_user.id]
     
-    unread_count = get_unread_notification_count()
     return render_template('messages/list.html', 
                          sent_messages=sent_messages, 
-                         received_messages=received_messages,
-                         unread_count=unread_count)
+                         received_messages=received_messages)
 
 @app.route('/messages/send', methods=['GET', 'POST'])
 @login_required
@@ -1476,9 +2073,8 @@ def send_message():
         return redirect(url_for('messages'))
     
     users = User.query.filter(User.id != current_user.id, User.is_active == True).all()
-    unread_count = get_unread_notification_count()
     
-    return render_template('messages/send.html', users=users, unread_count=unread_count)
+    return render_template('messages/send.html', users=users)
 
 @app.route('/messages/<int:message_id>')
 @login_required
@@ -1494,8 +2090,7 @@ def view_message(message_id):
         message.is_read = True
         db.session.commit()
     
-    unread_count = get_unread_notification_count()
-    return render_template('messages/view.html', message=message, unread_count=unread_count)
+    return render_template('messages/view.html', message=message)
 
 # ========== REVIEWS AND RATINGS ==========
 
@@ -1505,11 +2100,9 @@ def reviews():
     my_reviews = UserReview.query.filter_by(user_id=current_user.id).all()
     reviews_about_me = UserReview.query.filter_by(reviewed_user_id=current_user.id).all()
     
-    unread_count = get_unread_notification_count()
     return render_template('reviews/list.html', 
                          my_reviews=my_reviews, 
-                         reviews_about_me=reviews_about_me,
-                         unread_count=unread_count)
+                         reviews_about_me=reviews_about_me)
 
 @app.route('/reviews/create/<int:user_id>', methods=['GET', 'POST'])
 @login_required
@@ -1537,8 +2130,25 @@ def create_review(user_id):
         flash('Review submitted successfully!', 'success')
         return redirect(url_for('reviews'))
     
-    unread_count = get_unread_notification_count()
-    return render_template('reviews/create.html', reviewed_user=reviewed_user, unread_count=unread_count)
+    return render_template('reviews/create.html', reviewed_user=reviewed_user)
+
+# ========== PROFILING ==========
+
+@app.before_request
+def start_profiler():
+    # Opt-in per request with ?profile=1; disabled unless ENABLE_PROFILING is set
+    if app.config['PROFILING_ENABLED'] and request.args.get('profile') == '1':
+        from pyinstrument import Profiler
+        g.profiler = Profiler()
+        g.profiler.start()
+
+@app.after_request
+def stop_profiler(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.stop()
+    return make_response(profiler.output_html())
 
 # ========== HEALTH CHECK ==========
 
@@ -1571,27 +2181,37 @@ def get_profile_picture(user):
         return url_for('serve_upload', filename=f'profile_pictures/{user.profile_picture}')
     return '/static/images/default-profile.png'
 
+def precompile_templates():
+    """Compile every template once so preloaded Gunicorn workers inherit them"""
+    compiled = 0
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        try:
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except TemplateError:
+            logger.exception("Could not precompile template %s", name)
+    return compiled
+
 # ========== ERROR HANDLERS ==========
 
 @app.errorhandler(404)
 def not_found_error(error):
-    unread_count = get_unread_notification_count() if current_user.is_authenticated else 0
-    return render_template('404.html', unread_count=unread_count), 404
+    return render_template('404.html'), 404
 
 @app.errorhandler(500)
 def internal_error(error):
     db.session.rollback()
-    unread_count = get_unread_notification_count() if current_user.is_authenticated else 0
-    return render_template('500.html', unread_count=unread_count), 500
+    return render_template('500.html'), 500
 
 @app.errorhandler(502)
 def bad_gateway_error(error):
-    unread_count = get_unread_notification_count() if current_user.is_authenticated else 0
-    return render_template('502.html', unread_count=unread_count), 502
+    return render_template('502.html'), 502
 
 # ========== MAIN ==========
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
+    with app.app_context():
+        seed_database()
     app.run(host='0.0.0.0', port=port, debug=debug)
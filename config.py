@@ -1,5 +1,7 @@
 import os
+import tempfile
 from dotenv import load_dotenv
+from sqlalchemy.pool import NullPool
 
 load_dotenv()
 
@@ -17,16 +19,47 @@ class Config:
         SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///database.db')
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_RECORD_QUERIES = False
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'query_cache_size': 1200,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800
+    }
+    # Per-worker pool for server databases; SQLite keeps SQLAlchemy's default pool
+    if not (SQLALCHEMY_DATABASE_URI or '').startswith('sqlite'):
+        if os.getenv('DB_USE_PGBOUNCER', 'False').lower() == 'true':
+            # pgbouncer (transaction mode) already pools; a second pool per worker would only hold idle connections
+            SQLALCHEMY_ENGINE_OPTIONS['poolclass'] = NullPool
+        else:
+            SQLALCHEMY_ENGINE_OPTIONS.update({
+                'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+                'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 20)),
+                'pool_timeout': 10
+            })
+    else:
+        # Wait on a locked database instead of failing straight away with "database is locked"
+        SQLALCHEMY_ENGINE_OPTIONS['connect_args'] = {'timeout': 30}
     
     # File uploads
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
     UPLOAD_FOLDER = 'uploads'
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx'}
+    # When set (e.g. '/internal-uploads/'), uploads are handed to nginx via X-Accel-Redirect
+    UPLOADS_ACCEL_REDIRECT_PREFIX = os.getenv('UPLOADS_ACCEL_REDIRECT_PREFIX', '')
+    # Behind Apache with mod_xsendfile (or lighttpd), let send_file emit X-Sendfile instead of streaming
+    USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', 'False').lower() == 'true'
     
     # Ensure upload folder exists
     if not os.path.exists(UPLOAD_FOLDER):
         os.makedirs(UPLOAD_FOLDER)
     
+    # Caching - the filesystem cache persists across restarts and is shared by all workers
+    CACHE_TYPE = os.getenv('CACHE_TYPE', 'FileSystemCache')
+    CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'agriconnect-cache'))
+    CACHE_DEFAULT_TIMEOUT = 300
+    # Set CACHE_TYPE=RedisCache and REDIS_URL to share the cache across instances
+    CACHE_REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    
     # API Keys
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
@@ -43,4 +76,8 @@ class Config:
     SMTP_PASSWORD = os.getenv('SMTP_PASSWORD', '')
     
     # Flask configuration
+    # Lets ?profile=1 return a pyinstrument report instead of the page; never enable publicly
+    PROFILING_ENABLED = os.getenv('ENABLE_PROFILING', 'False').lower() == 'true'
+    # Templates never change on a deployed instance, so skip the per-render mtime check
+    TEMPLATES_AUTO_RELOAD = False if os.environ.get('RENDER') else None
     PREFERRED_URL_SCHEME = 'https' if os.environ.get('RENDER') else 'http'
@@ -6,8 +6,11 @@ bind = "0.0.0.0:" + os.environ.get("PORT", "10000")
 backlog = 2048
 
 # Worker processes
-workers = 2  # Reduced for free tier
-worker_class = "sync"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))  # Reduced for free tier
+worker_class = "gthread"
+# Requests spend most of their time waiting on the database and external APIs,
+# so threads (not processes) are the cheap way to serve more of them at once
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
 worker_connections = 1000
 timeout = 120
 keepalive = 2
@@ -21,6 +24,7 @@ loglevel = "info"
 proc_name = "agri_assistant"
 
 # Server mechanics
+preload_app = True  # Import the app once in the master and share it copy-on-write
 daemon = False
 pidfile = None
 umask = 0
@@ -31,6 +35,10 @@ tmp_upload_dir = None
 # Server hooks
 def post_fork(server, worker):
     server.log.info("Worker spawned (pid: %s)", worker.pid)
+    # Connections inherited from the preloaded master must not be shared across processes
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
 
 def pre_fork(server, worker):
     pass
@@ -39,6 +47,9 @@ def pre_exec(server):
     server.log.info("Forked child, re-executing.")
 
 def when_ready(server):
+    # Compile templates in the master so every forked worker starts with a warm cache
+    from app import precompile_templates
+    server.log.info("Precompiled %s templates", precompile_templates())
     server.log.info("Server is ready. Spawning workers")
 
 def worker_int(worker):
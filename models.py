@@ -2,9 +2,33 @@ from datetime import datetime
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.pagination import QueryPagination
+from flask_sqlalchemy.query import Query
+from sqlalchemy import DDL, event, func, inspect
+
+class CountQueryPagination(QueryPagination):
+    """Counts with a bare COUNT(*) instead of wrapping the ordered SELECT in a subquery"""
+    
+    def _query_count(self):
+        query = self._query_args["query"]
+        if query._distinct or query._group_by_clauses:
+            return super()._query_count()
+        primary_key = inspect(query.column_descriptions[0]['entity']).primary_key[0]
+        return query.enable_eagerloads(False).order_by(None).with_entities(func.count(primary_key)).scalar()
+
+class PaginatedQuery(Query):
+    def paginate(self, *, page=None, per_page=None, max_per_page=None, error_out=True, count=True):
+        return CountQueryPagination(
+            query=self,
+            page=page,
+            per_page=per_page,
+            max_per_page=max_per_page,
+            error_out=error_out,
+            count=count,
+        )
 
 # Create db instance - don't import from app.py
-db = SQLAlchemy()
+db = SQLAlchemy(query_class=PaginatedQuery)
 
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
@@ -31,6 +55,16 @@ class User(db.Model, UserMixin):
     
     def get_id(self):
         return str(self.id)
+    
+    __table_args__ = (
+        db.Index('ix_users_type_active', 'user_type', 'is_active'),
+        db.Index('ix_users_created', 'created_at'),
+        # Trigram indexes let PostgreSQL serve the admin and recipient ILIKE searches, even with a leading %
+        db.Index('ix_users_full_name_trgm', 'full_name', postgresql_using='gin',
+                 postgresql_ops={'full_name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_users_email_trgm', 'email', postgresql_using='gin',
+                 postgresql_ops={'email': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
 
 class InventoryItem(db.Model):
     __tablename__ = 'inventory_items'
@@ -47,8 +81,22 @@ class InventoryItem(db.Model):
     reorder_level = db.Column(db.Integer, default=10)
     supplier = db.Column(db.String(100))
     sku = db.Column(db.String(50), unique=True)
+    image = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    agrovet = db.relationship('User')
+    
+    # Partial indexes: only in-stock rows are browsed, only low-stock rows are alerted on
+    __table_args__ = (
+        db.Index('ix_inventory_name_price', 'product_name', 'price',
+                 postgresql_where=quantity > 0, sqlite_where=quantity > 0),
+        db.Index('ix_inventory_agrovet_low_stock', 'agrovet_id',
+                 postgresql_where=quantity <= reorder_level, sqlite_where=quantity <= reorder_level),
+        db.Index('ix_inventory_agrovet_name', 'agrovet_id', 'product_name'),
+        db.Index('ix_inventory_category', 'category',
+                 postgresql_where=quantity > 0, sqlite_where=quantity > 0),
+    )
 
 class Customer(db.Model):
     __tablename__ = 'customers'
@@ -64,6 +112,8 @@ class Customer(db.Model):
     last_purchase = db.Column(db.DateTime)
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_customer_agrovet_created', 'agrovet_id', 'created_at'),)
 
 class Sale(db.Model):
     __tablename__ = 'sales'
@@ -75,6 +125,10 @@ class Sale(db.Model):
     payment_method = db.Column(db.String(50))  # cash, mpesa, card
     receipt_number = db.Column(db.String(50), unique=True)
     sale_date = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    customer = db.relationship('Customer')
+    
+    __table_args__ = (db.Index('ix_sale_agrovet_date', 'agrovet_id', 'sale_date'),)
 
 class SaleItem(db.Model):
     __tablename__ = 'sale_items'
@@ -110,8 +164,12 @@ class DiseaseReport(db.Model):
     location = db.Column(db.String(100))
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
-    status = db.Column(db.String(50), default='pending')  # pending, reviewed, treated
+    status = db.Column(db.String(50), default='pending')  # analyzing, failed, pending, reviewed, treated
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    farmer = db.relationship('User')
+    
+    __table_args__ = (db.Index('ix_disease_farmer_created', 'farmer_id', 'created_at'),)
 
 class Notification(db.Model):
     __tablename__ = 'notifications'
@@ -124,6 +182,12 @@ class Notification(db.Model):
     link = db.Column(db.String(500))
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_notif_user_unread_created', 'user_id', 'is_read', 'created_at'),
+        # The notifications page lists read and unread together, newest first
+        db.Index('ix_notif_user_created', 'user_id', 'created_at'),
+    )
 
 class WeatherData(db.Model):
     __tablename__ = 'weather_data'
@@ -153,6 +217,11 @@ class CommunityPost(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_post_created_id', 'created_at', 'id'),
+        db.Index('ix_post_author_created', 'author_id', 'created_at'),
+    )
 
 class PostComment(db.Model):
     __tablename__ = 'post_comments'
@@ -164,6 +233,8 @@ class PostComment(db.Model):
     is_answer = db.Column(db.Boolean, default=False)
     likes = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_comment_post_created', 'post_id', 'created_at'),)
 
 class PostFollow(db.Model):
     __tablename__ = 'post_follows'
@@ -187,6 +258,8 @@ class UserReview(db.Model):
     is_approved = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    reviewer = db.relationship('User', foreign_keys=[reviewer_id])
+    
     __table_args__ = (db.UniqueConstraint('user_id', 'reviewer_id', name='unique_user_review'),)
 
 class AppRecommendation(db.Model):
@@ -209,6 +282,13 @@ class CartItem(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('inventory_items.id'), nullable=False)
     quantity = db.Column(db.Integer, default=1)
     added_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    product = db.relationship('InventoryItem')
+    
+    __table_args__ = (
+        db.Index('ix_cart_user', 'user_id', postgresql_include=['product_id', 'quantity']),
+        db.UniqueConstraint('user_id', 'product_id', name='unique_cart_product'),
+    )
 
 class Order(db.Model):
     __tablename__ = 'orders'
@@ -225,6 +305,15 @@ class Order(db.Model):
     status = db.Column(db.String(50), default='pending')  # pending, confirmed, processing, shipped, delivered, cancelled
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    items = db.relationship('OrderItem', backref='order')
+    farmer = db.relationship('User', foreign_keys=[farmer_id])
+    agrovet = db.relationship('User', foreign_keys=[agrovet_id])
+    
+    __table_args__ = (
+        db.Index('ix_order_farmer_created', 'farmer_id', 'created_at'),
+        db.Index('ix_order_agrovet_created', 'agrovet_id', 'created_at'),
+    )
 
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
@@ -236,6 +325,8 @@ class OrderItem(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Float, nullable=False)
     subtotal = db.Column(db.Float, nullable=False)
+    
+    product = db.relationship('InventoryItem')
 
 class PasswordResetToken(db.Model):
     __tablename__ = 'password_reset_tokens'
@@ -246,6 +337,8 @@ class PasswordResetToken(db.Model):
     expires_at = db.Column(db.DateTime, nullable=False)
     used = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user = db.relationship('User')
 
 class Message(db.Model):
     __tablename__ = 'messages'
@@ -259,3 +352,30 @@ class Message(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('inventory_items.id'))
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_message_sender_created', 'sender_id', 'created_at'),
+        db.Index('ix_message_receiver_created', 'receiver_id', 'created_at'),
+    )
+
+class LoginFailure(db.Model):
+    """Failed logins per client address and email in one rate-limit window"""
+    __tablename__ = 'login_failures'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    address = db.Column(db.String(45), nullable=False)
+    email = db.Column(db.String(120), nullable=False)
+    window_start = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, default=0, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('address', 'email', 'window_start', name='unique_login_failure'),
+        db.Index('ix_login_failures_window', 'window_start'),
+    )
+
+# gin_trgm_ops comes from pg_trgm, which has to exist before the trigram indexes are created
+event.listen(
+    db.metadata,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)